@@ -8,11 +8,81 @@ Compatible with: Python 3.9.13+
 
 import os
 import sys
+import base64
 import subprocess
 from pathlib import Path
-from datetime import datetime
 import time
 import re
+import asyncio
+
+# Command output is copied to the log in blocks rather than line by line
+_READ_SIZE = 65536
+_BUFFER_SIZE = 1024 * 1024
+_FLUSH_THRESHOLD = _BUFFER_SIZE // 2
+_FLUSH_INTERVAL = 0.1  # seconds
+_DRAIN_TIMEOUT = 0.1  # seconds of silence after exit before giving up on EOF, also the exit check period
+
+# Patterns used by extract_command_name
+_SPLIT_RE = re.compile(r'[\s|;]')
+_SANITIZE_RE = re.compile(r'[^a-zA-Z0-9_-]')
+_SCRIPT_EXTENSIONS = ('.ps1', '.exe', '.cmd', '.bat')
+
+# Characters PowerShell treats as single quotes (ASCII and Unicode variants)
+_PS_QUOTE_RE = re.compile('[\'\u2018-\u201b]')
+
+# PowerShell script of the log viewer console, filled in with str.format
+_VIEWER_TEMPLATE = """
+$command = {command}
+$logPath = {log_path}
+
+$Host.UI.RawUI.WindowTitle = "ECCO Log Viewer"
+Write-Host "=== ECCO LOG VIEWER ===" -ForegroundColor Cyan
+Write-Host "Command: $command" -ForegroundColor Yellow
+Write-Host "Log: $logPath" -ForegroundColor Gray
+Write-Host "==================================================="
+Write-Host ""
+
+# Follow the log file from the end of its previous content until we see the completion marker
+# (read directly instead of through Get-Content -Wait, which only polls once per second)
+$stream = [System.IO.File]::Open($logPath, 'Open', 'Read', 'ReadWrite')
+$null = $stream.Seek({initial_size}, 'Begin')
+$reader = New-Object System.IO.StreamReader($stream, [System.Text.Encoding]::UTF8)
+$pending = ""
+:follow while ($true) {{
+    $chunk = $reader.ReadToEnd()
+    if ($chunk.Length -eq 0) {{
+        Start-Sleep -Milliseconds 50
+        continue
+    }}
+
+    # Only show complete lines, a partial last line waits for the rest of it
+    $lines = ($pending + $chunk) -split "`r?`n"
+    $pending = $lines[-1]
+    for ($n = 0; $n -lt $lines.Length - 1; $n++) {{
+        $line = $lines[$n]
+        Write-Host $line
+        if ($line.Contains('[SUCCESS]') -or $line.Contains('[ERROR]')) {{
+            # Command completed, notify user and close automatically
+            Write-Host ""
+            Write-Host ("===================================================") -ForegroundColor Cyan
+            Write-Host "Command execution completed." -ForegroundColor Green
+            Write-Host "This window will close automatically in 5 seconds..." -ForegroundColor Yellow
+            Write-Host ("===================================================") -ForegroundColor Cyan
+
+            # Countdown
+            for ($i = 5; $i -gt 0; $i--) {{
+                Write-Host "Closing in $i..." -NoNewline
+                Start-Sleep -Seconds 1
+                Write-Host "`r" -NoNewline
+            }}
+
+            # Exit the viewer
+            break follow
+        }}
+    }}
+}}
+$reader.Close()
+"""
 
 def extract_command_name(command):
     """
@@ -35,16 +105,21 @@ def extract_command_name(command):
     
     # Extract the first token (before first space, pipe, semicolon, etc.)
     # Split on common separators
-    first_token = re.split(r'[\s|;]', command, maxsplit=1)[0]
+    first_token = _SPLIT_RE.split(command, maxsplit=1)[0]
     
-    # Get just the filename (remove path)
-    command_name = Path(first_token).name
-    
-    # Remove extension if present
-    command_name = Path(command_name).stem if '.' in command_name else command_name
+    # Get just the filename (remove path) without its extension
+    if first_token.endswith(_SCRIPT_EXTENSIONS):
+        # Common case of a script or executable path: plain string operations suffice
+        command_name = first_token.rsplit('\\', 1)[-1].rsplit('/', 1)[-1]
+        # Like os.path.splitext, leading dots are part of the name, not an extension
+        dot = command_name.rindex('.')
+        if command_name[:dot].lstrip('.'):
+            command_name = command_name[:dot]
+    else:
+        command_name = os.path.splitext(os.path.basename(first_token))[0]
     
     # Sanitize for filesystem (keep only alphanumeric, dash, underscore)
-    safe_name = re.sub(r'[^a-zA-Z0-9_-]', '_', command_name)
+    safe_name = _SANITIZE_RE.sub('_', command_name)
     
     # Limit length and clean up
     safe_name = safe_name[:30].strip('_')
@@ -55,6 +130,132 @@ def extract_command_name(command):
     
     return safe_name
 
+def _write_text(log_fp, text):
+    """
+    Append text to the binary log handle as UTF-8.
+    
+    Newlines are translated to the platform convention, as a text-mode handle would.
+    
+    Args:
+        log_fp: Log file opened in unbuffered binary append mode
+        text: The text to write
+    """
+    log_fp.write(text.replace('\n', os.linesep).encode('utf-8'))
+
+def _quote_powershell(text):
+    """
+    Quote text as a single-quoted PowerShell string literal.
+    
+    Inside single quotes only quote characters are special, and doubling them
+    makes them literal, so no other escaping is needed.
+    
+    Args:
+        text: The text to quote
+        
+    Returns:
+        The PowerShell literal, quotes included
+    """
+    return "'" + _PS_QUOTE_RE.sub(r'\g<0>\g<0>', text) + "'"
+
+def _encode_powershell(script):
+    """
+    Encode a script for powershell.exe -EncodedCommand (base64 of UTF-16LE).
+    
+    Args:
+        script: The PowerShell script text
+        
+    Returns:
+        The encoded script, safe to pass as a single argument
+    """
+    return base64.b64encode(script.encode('utf-16-le')).decode('ascii')
+
+async def _run_command(command, log_fp):
+    """
+    Execute a PowerShell command and copy its output to the log in batches.
+    
+    Output is accumulated in a fixed buffer and written once _FLUSH_THRESHOLD bytes
+    are pending or _FLUSH_INTERVAL seconds have passed since the last write, so the
+    viewer still sees it promptly without paying one write() per line. The pipe is
+    read asynchronously, so the process keeps draining while the log is written.
+    
+    Args:
+        command: The PowerShell command to execute (plain text)
+        log_fp: Log file opened in unbuffered binary append mode
+        
+    Returns:
+        The exit code of the command
+    """
+    # Execute the command directly without encoding tricks
+    # This preserves Write-Host output properly, but may have issues with quotes/special chars
+    # Output is kept as raw bytes: it is forwarded to the log without decoding
+    process = await asyncio.create_subprocess_exec(
+        'powershell.exe',
+        '-NoProfile',
+        '-ExecutionPolicy', 'Bypass',
+        '-Command', command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+    
+    # The pending read survives timeouts, so no output is lost between wakeups
+    read = None
+    
+    # Preallocated so that batching output never reallocates: chunks are copied in
+    # at `used` and the filled part is written out through a memoryview
+    buffer = bytearray(_BUFFER_SIZE)
+    view = memoryview(buffer)
+    used = 0
+    last_flush = time.monotonic()
+    while True:
+        if read is None:
+            read = asyncio.ensure_future(process.stdout.read(_READ_SIZE))
+        
+        # Wait for output, or only until pending output is due. Exit is checked through
+        # returncode, which is set as soon as the process ends (wait() only resolves
+        # once every pipe is closed), hence the periodic wakeup while idle
+        draining = not used and process.returncode is not None
+        if used:
+            timeout = max(0.0, last_flush + _FLUSH_INTERVAL - time.monotonic())
+        else:
+            # Once the command is gone, only collect what is left: a background
+            # process that inherited the pipe must not keep us waiting for EOF
+            timeout = _DRAIN_TIMEOUT
+        await asyncio.wait({read}, timeout=timeout)
+        
+        chunk = None
+        if read.done():
+            chunk = read.result()
+            read = None
+        
+        if chunk:
+            buffer[used:used + len(chunk)] = chunk
+            used += len(chunk)
+        
+        # Done at EOF, or when the pipe stayed quiet for _DRAIN_TIMEOUT after exit
+        done = chunk == b'' or (draining and chunk is None)
+        
+        # A read never exceeds _READ_SIZE, so flushing at _FLUSH_THRESHOLD keeps room for the next one
+        now = time.monotonic()
+        if used and (done or used >= _FLUSH_THRESHOLD
+                     or now - last_flush >= _FLUSH_INTERVAL):
+            log_fp.write(view[:used])
+            used = 0
+            last_flush = now
+        
+        if done:
+            break
+    
+    if read is None:
+        # EOF: every pipe is closed, so wait() resolves right away
+        return await process.wait()
+    
+    # The pipe is still held open by another process: let go of it explicitly, and
+    # give the loop a turn to run the close callbacks before asyncio.run() ends
+    read.cancel()
+    process._transport.close()
+    await asyncio.sleep(0)
+    return process.returncode
+
 def run_command_with_viewer(command, log_folder=None, log_file=None):
     """
     Execute a PowerShell command and capture its output with a real-time log viewer.
@@ -65,7 +266,7 @@ def run_command_with_viewer(command, log_folder=None, log_file=None):
         log_file: Specific log file path (takes precedence over log_folder)
     """
     # Generate timestamp (used in log header and optionally in filename)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
 
     if log_file:
         # Use the specified file path directly
@@ -82,127 +283,87 @@ def run_command_with_viewer(command, log_folder=None, log_file=None):
         
         # Generate log filename
         log_filename = f"log_{command_name}_{timestamp}.log"
-        log_file_path = log_path.joinpath(log_filename).resolve()
+        # log_path is already resolved, the file name adds no link to follow
+        log_file_path = log_path.joinpath(log_filename)
+    
+    # String form used for everything downstream (open, header, viewer)
+    log_file_path = os.fspath(log_file_path)
     
     print(f"Executing command: {command}")
     print(f"Log file: {log_file_path}")
     
-    # Count existing lines if file exists (so viewer can skip them)
-    initial_line_count = 0
-    if log_file_path.exists():
+    # Keep a single handle on the log for the header, the output and the footer
+    # Unbuffered: every write is already a whole block, and must reach the viewer at once
+    log_fp = open(log_file_path, 'ab', buffering=0)
+    try:
+        # Remember where the existing content ends (so viewer can skip it)
+        initial_size = os.fstat(log_fp.fileno()).st_size
+        if initial_size:
+            print(f"Appending to existing log ({initial_size} existing bytes)")
+        
+        # Create/append to the log file with header
+        _write_text(log_fp,
+                    f"=== Executing PowerShell Command ===\n"
+                    f"Command: {command}\n"
+                    f"Log: {log_file_path}\n"
+                    f"Started: {timestamp}\n"
+                    f"{'=' * 50}\n\n")
+        
+        # Launch log viewer console FIRST
+        ps_viewer_command = _VIEWER_TEMPLATE.format(
+            command=_quote_powershell(command),
+            log_path=_quote_powershell(log_file_path),
+            initial_size=initial_size
+        )
+        
+        # Go through conhost so the viewer always gets its own classic console window:
+        # where Windows Terminal is the default terminal, CREATE_NEW_CONSOLE alone would
+        # open it as a tab, with its own title and closing behavior
+        # The viewer is a convenience: if it cannot be launched (e.g. a very long command
+        # exceeding the command line limit), still run the command and capture its log
         try:
-            with open(log_file_path, 'r', encoding='utf-8', errors='replace') as f:
-                initial_line_count = sum(1 for _ in f)
-            print(f"Appending to existing log ({initial_line_count} existing lines)")
-        except Exception as e:
-            print(f"Warning: Could not count existing lines: {e}")
-    
-    # Create/append to the log file with header
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        log_file.write(f"=== Executing PowerShell Command ===\n")
-        log_file.write(f"Command: {command}\n")
-        log_file.write(f"Log: {log_file_path}\n")
-        log_file.write(f"Started: {timestamp}\n")
-        log_file.write("=" * 50 + "\n\n")
-    
-    # Launch log viewer console FIRST
-    # Escape double quotes for PowerShell string (double them)
-    command_escaped = command.replace('"', '""').replace('`', '``').replace('$', '`$')
-    log_path_escaped = str(log_file_path).replace('"', '""')
-    
-    ps_viewer_command = f"""
-    $Host.UI.RawUI.WindowTitle = "ECCO Log Viewer"
-    Write-Host "=== ECCO LOG VIEWER ===" -ForegroundColor Cyan
-    Write-Host "Command: {command_escaped}" -ForegroundColor Yellow
-    Write-Host "Log: {log_path_escaped}" -ForegroundColor Gray
-    Write-Host "==================================================="
-    Write-Host ""
-    
-    # Follow the log file, skipping existing lines, until we see the completion marker
-    Get-Content -Path '{log_path_escaped}' -Wait -Encoding UTF8 | Select-Object -Skip {initial_line_count} | ForEach-Object {{
-        Write-Output $_
-        if ($_ -match '\\[SUCCESS\\]|\\[ERROR\\]') {{
-            # Command completed, notify user and close automatically
-            Write-Host ""
-            Write-Host ("===================================================") -ForegroundColor Cyan
-            Write-Host "Command execution completed." -ForegroundColor Green
-            Write-Host "This window will close automatically in 5 seconds..." -ForegroundColor Yellow
-            Write-Host ("===================================================") -ForegroundColor Cyan
-            
-            # Countdown
-            for ($i = 5; $i -gt 0; $i--) {{
-                Write-Host "Closing in $i..." -NoNewline
-                Start-Sleep -Seconds 1
-                Write-Host "`r" -NoNewline
-            }}
-            
-            # Exit the viewer
-            break
-        }}
-    }}
-    """
-    
-    viewer_process = subprocess.Popen([
-        'conhost',
-        'powershell.exe',
-        '-NoProfile',
-        '-ExecutionPolicy', 'Bypass',
-        '-Command', ps_viewer_command
-    ], creationflags=subprocess.CREATE_NEW_CONSOLE)
-    
-    # Give the viewer a moment to start
-    time.sleep(0.5)
-    
-    print(f"Log viewer console opened. Starting command execution...")
-    
-    # Execute the command directly without encoding tricks
-    # This preserves Write-Host output properly, but may have issues with quotes/special chars
-    command_process = subprocess.Popen([
-        'powershell.exe',
-        '-NoProfile',
-        '-ExecutionPolicy', 'Bypass',
-        '-Command', command
-    ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        encoding='utf-8',
-        errors='replace',
-        bufsize=1
-    )
-    
-    # Write output to log file in real-time
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        for line in iter(command_process.stdout.readline, ''):
-            if line:
-                log_file.write(line)
-                log_file.flush()  # Important: flush so viewer can see it
-    
-    # Wait for command to complete
-    command_process.wait()
-    
-    # Write footer to log
-    end_time = datetime.now()
-    with open(log_file_path, 'a', encoding='utf-8') as log_file:
-        log_file.write(f"\n\n")
-        log_file.write("=" * 50 + "\n")
-        log_file.write(f"=== Execution completed ===\n")
-        log_file.write(f"Ended: {end_time.strftime('%Y%m%d_%H%M%S')}\n")
-        log_file.write(f"Exit code: {command_process.returncode}\n")
-        log_file.write("=" * 50 + "\n")
-        
-        if command_process.returncode == 0:
-            log_file.write("\n[SUCCESS] Command completed successfully.\n")
+            viewer_process = subprocess.Popen([
+                'conhost',
+                'powershell.exe',
+                '-NoProfile',
+                '-ExecutionPolicy', 'Bypass',
+                '-EncodedCommand', _encode_powershell(ps_viewer_command)
+            ], creationflags=subprocess.CREATE_NEW_CONSOLE)
+        except OSError as e:
+            print(f"Warning: Could not open log viewer console: {e}")
+            print(f"Starting command execution without viewer...")
+        else:
+            # No need to wait for the viewer to start: it reads the log from initial_size,
+            # so it shows everything written from here on whenever it gets there
+            print(f"Log viewer console opened. Starting command execution...")
+        
+        # Write output to log file in real-time (batched, see _run_command)
+        exit_code = asyncio.run(_run_command(command, log_fp))
+        
+        # Write footer to log
+        end_time = time.strftime("%Y%m%d_%H%M%S")
+        if exit_code == 0:
+            status = "[SUCCESS] Command completed successfully."
         else:
-            log_file.write(f"\n[ERROR] Command failed with exit code {command_process.returncode}.\n")
+            status = f"[ERROR] Command failed with exit code {exit_code}."
+        _write_text(log_fp,
+                    f"\n\n"
+                    f"{'=' * 50}\n"
+                    f"=== Execution completed ===\n"
+                    f"Ended: {end_time}\n"
+                    f"Exit code: {exit_code}\n"
+                    f"{'=' * 50}\n"
+                    f"\n{status}\n")
+    finally:
+        log_fp.close()
     
-    print(f"Completed with exit code: {command_process.returncode}")
+    print(f"Completed with exit code: {exit_code}")
     
     # Don't wait for the viewer to close - it will close itself after countdown
     # This allows the caller to get control back immediately
     
     # Return the exit code
-    return command_process.returncode
+    return exit_code
 
 if __name__ == "__main__":
     if len(sys.argv) < 2: